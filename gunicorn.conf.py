@@ -0,0 +1,14 @@
+import multiprocessing
+import os
+
+# Gunicorn configuration: gunicorn -c gunicorn.conf.py
+wsgi_app = 'app:create_app()'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gevent'
+worker_connections = 1000
+
+# Build the app (and its SQLAlchemy engine) once in the master; each forked worker
+# then opens its own pooled connections on first use.
+preload_app = True
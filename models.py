@@ -1,118 +1,186 @@
+from datetime import date, datetime
+from typing import Optional
 from flask_login import UserMixin
+from sqlalchemy import JSON, Enum, ForeignKey, Index, LargeBinary, String, Text, UniqueConstraint, column, false, func
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app import db
-from datetime import datetime
-import json
+
+# Compact enumerated column types for fixed ASCII value sets
+shift_enum = Enum('Early Morning', 'Morning', 'Afternoon', 'Evening', 'Night', name='shift_enum')
+
+# Fixed-width 32-byte digest column (BINARY(32) on MySQL so it can be indexed)
+digest_type = LargeBinary(32).with_variant(mysql.BINARY(32), 'mysql')
 
 #----------------------------------------------------------------------------#
 # Models with Enhanced State Management
 #----------------------------------------------------------------------------#
 
 class User(db.Model, UserMixin):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100), unique=True, nullable=False)
-    email = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(255), nullable=False)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    username: Mapped[str] = mapped_column(String(100), unique=True)
+    email: Mapped[str] = mapped_column(String(150), unique=True)
+    password: Mapped[str] = mapped_column(String(255), deferred=True)  # Only loaded for authentication
+    api_usage: Mapped[list['APIUsageLog']] = relationship(back_populates='user')
+
+    # Functional indexes for case-insensitive login lookups; unique so no two accounts differ only by case
+    __table_args__ = (
+        Index('ix_user_email_lower', func.lower(email), unique=True),
+        Index('ix_user_username_lower', func.lower(username), unique=True),
+    )
 
 class Designation(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(100), nullable=False, unique=True)
-    hierarchy_level = db.Column(db.Integer, nullable=False)
-    monthly_leave_allowance = db.Column(db.Integer, default=0)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    title: Mapped[str] = mapped_column(String(100), unique=True)
+    hierarchy_level: Mapped[int]
+    monthly_leave_allowance: Mapped[Optional[int]] = mapped_column(default=0)
+    employees: Mapped[list['Employee']] = relationship(back_populates='designation')
 
 class Employee(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(150), nullable=False)
-    email = db.Column(db.String(150), unique=True, nullable=False)
-    designation_id = db.Column(db.Integer, db.ForeignKey('designation.id'))
-    designation = db.relationship('Designation', backref='employees')
-    leave_dates = db.Column(db.String(255))
-    gender = db.Column(db.String(10))
-    shift_preference = db.Column(db.String(50))
-    is_active = db.Column(db.Boolean, default=True)  # NEW: Handle staff departures
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(150))
+    email: Mapped[str] = mapped_column(String(150), unique=True)
+    designation_id: Mapped[Optional[int]] = mapped_column(ForeignKey('designation.id'))
+    designation: Mapped[Optional['Designation']] = relationship(back_populates='employees', lazy='joined')
+    leave_dates: Mapped[Optional[str]] = mapped_column(String(255))  # Legacy JSON list, superseded by EmployeeLeave
+    gender: Mapped[Optional[str]] = mapped_column(Enum('Male', 'Female', 'prefer not say', name='gender_enum'))
+    shift_preference: Mapped[Optional[str]] = mapped_column(String(50))
+    is_active: Mapped[Optional[bool]] = mapped_column(default=True)  # NEW: Handle staff departures
+    teams: Mapped[list['TeamMember']] = relationship(back_populates='employee')
+    history: Mapped[list['EmployeeHistory']] = relationship(back_populates='employee')
+    leaves: Mapped[list['EmployeeLeave']] = relationship(back_populates='employee',
+                                                         order_by='EmployeeLeave.leave_date', cascade='all, delete-orphan')
+
+class EmployeeLeave(db.Model):
+    """A single leave day for an employee"""
+    id: Mapped[int] = mapped_column(primary_key=True)
+    employee_id: Mapped[int] = mapped_column(ForeignKey('employee.id'))
+    leave_date: Mapped[date]
+
+    employee: Mapped['Employee'] = relationship(back_populates='leaves')
+
+    __table_args__ = (
+        UniqueConstraint('employee_id', 'leave_date'),
+        Index('ix_leave_date_emp', 'leave_date', 'employee_id'),
+    )
 
 class Team(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(150), nullable=False)
-    shift_template = db.Column(db.String(50))
-    people_per_shift = db.Column(db.Integer)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(150))
+    shift_template: Mapped[Optional[str]] = mapped_column(String(50))
+    people_per_shift: Mapped[Optional[int]]
+    # Dependent rows are removed by ON DELETE CASCADE, so the ORM neither loads nor nulls them
+    members: Mapped[list['TeamMember']] = relationship(back_populates='team', passive_deletes='all')
+    saved_schedule: Mapped[Optional['SavedSchedule']] = relationship(back_populates='team', passive_deletes='all')
+    history: Mapped[list['EmployeeHistory']] = relationship(back_populates='team', passive_deletes='all')
+    validation_logs: Mapped[list['ScheduleValidationLog']] = relationship(back_populates='team', passive_deletes='all')
+    api_usage: Mapped[list['APIUsageLog']] = relationship(back_populates='team', passive_deletes='all')
+    rule_violations: Mapped[list['RuleViolation']] = relationship(back_populates='team', passive_deletes='all')
 
 class TeamMember(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
-    employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'))
-    team = db.relationship('Team', backref='members')
-    employee = db.relationship('Employee', backref='teams')
+    id: Mapped[int] = mapped_column(primary_key=True)
+    team_id: Mapped[Optional[int]] = mapped_column(ForeignKey('team.id', ondelete='CASCADE'))
+    employee_id: Mapped[Optional[int]] = mapped_column(ForeignKey('employee.id'))
+    team: Mapped[Optional['Team']] = relationship(back_populates='members')
+    employee: Mapped[Optional['Employee']] = relationship(back_populates='teams')
 
 class SavedSchedule(db.Model):
     """Stores a complete, generated monthly schedule for a team."""
-    id = db.Column(db.Integer, primary_key=True)
-    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False, unique=True)
-    schedule_data = db.Column(db.Text, nullable=False) 
-    generated_on = db.Column(db.DateTime, default=datetime.utcnow)
-    team = db.relationship('Team', backref=db.backref('saved_schedule', uselist=False))
+    id: Mapped[int] = mapped_column(primary_key=True)
+    team_id: Mapped[int] = mapped_column(ForeignKey('team.id', ondelete='CASCADE'), unique=True)
+    schedule_data: Mapped[dict] = mapped_column(JSON)
+    generated_on: Mapped[datetime] = mapped_column(server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now())  # Drives the page ETag
+    team: Mapped['Team'] = relationship(back_populates='saved_schedule')
 
 # NEW: Historical State Management Tables
 class EmployeeHistory(db.Model):
     """Tracks employee assignment history for the last 3 months"""
-    id = db.Column(db.Integer, primary_key=True)
-    employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
-    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
-    month_year = db.Column(db.String(20), nullable=False)  # Format: "2025-01"
-    shift_assigned = db.Column(db.String(50))  # Morning, Afternoon, etc.
-    was_floater = db.Column(db.Boolean, default=False)
-    floater_for_shift = db.Column(db.String(50))  # If floater, which shift they backed up
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    employee = db.relationship('Employee', backref='history')
-    team = db.relationship('Team', backref='history')
-    
-    __table_args__ = (db.UniqueConstraint('employee_id', 'team_id', 'month_year'),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    employee_id: Mapped[int] = mapped_column(ForeignKey('employee.id'))
+    team_id: Mapped[int] = mapped_column(ForeignKey('team.id', ondelete='CASCADE'))
+    month_year: Mapped[int]  # Format: YYYYMM, e.g. 202501
+    shift_assigned: Mapped[Optional[str]] = mapped_column(shift_enum)
+    was_floater: Mapped[Optional[bool]] = mapped_column(default=False)
+    floater_for_shift: Mapped[Optional[str]] = mapped_column(shift_enum)  # If floater, which shift they backed up
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    employee: Mapped['Employee'] = relationship(back_populates='history')
+    team: Mapped['Team'] = relationship(back_populates='history')
+
+    __table_args__ = (
+        UniqueConstraint('employee_id', 'team_id', 'month_year'),
+        Index('ix_emphist_team_month', 'team_id', 'month_year'),
+        Index('ix_emphist_emp_month', 'employee_id', 'month_year'),
+    )
 
 class ScheduleValidationLog(db.Model):
     """Logs validation results for schedules"""
-    id = db.Column(db.Integer, primary_key=True)
-    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
-    validation_result = db.Column(db.Text)  # JSON string of validation results
-    violations_found = db.Column(db.Integer, default=0)
-    is_valid = db.Column(db.Boolean, default=True)
-    validated_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    team = db.relationship('Team', backref='validation_logs')
+    id: Mapped[int] = mapped_column(primary_key=True)
+    team_id: Mapped[int] = mapped_column(ForeignKey('team.id', ondelete='CASCADE'))
+    validation_result: Mapped[Optional[dict]] = mapped_column(JSON)  # Validation results
+    violations_found: Mapped[Optional[int]] = mapped_column(default=0)
+    is_valid: Mapped[Optional[bool]] = mapped_column(default=True)
+    validated_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    schedule_hash: Mapped[Optional[bytes]] = mapped_column(digest_type, index=True)  # SHA-256 of the validated schedule
+
+    team: Mapped['Team'] = relationship(back_populates='validation_logs')
+
+    __table_args__ = (Index('ix_validation_team_time', 'team_id', 'validated_at'),)
 
 class APIUsageLog(db.Model):
     """Track API usage for cost control and rate limiting"""
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
-    api_type = db.Column(db.String(50))  # 'generate', 'validate', 'fix'
-    tokens_used = db.Column(db.Integer, default=0)
-    cost_estimate = db.Column(db.Float, default=0.0)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    success = db.Column(db.Boolean, default=True)
-    
-    user = db.relationship('User', backref='api_usage')
-    team = db.relationship('Team', backref='api_usage')
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.id'))
+    team_id: Mapped[Optional[int]] = mapped_column(ForeignKey('team.id', ondelete='CASCADE'))
+    api_type: Mapped[Optional[str]] = mapped_column(Enum('generate', 'validate', 'fix', name='api_type_enum'))
+    tokens_used: Mapped[Optional[int]] = mapped_column(default=0)
+    cost_estimate: Mapped[Optional[float]] = mapped_column(default=0.0)
+    timestamp: Mapped[datetime] = mapped_column(server_default=func.now())
+    success: Mapped[Optional[bool]] = mapped_column(default=True)
+
+    user: Mapped['User'] = relationship(back_populates='api_usage')
+    team: Mapped[Optional['Team']] = relationship(back_populates='api_usage')
+
+    __table_args__ = (
+        Index('ix_api_user_ts', 'user_id', 'timestamp'),
+        Index('ix_apiusage_user_type_time', 'user_id', 'api_type', 'timestamp'),
+        # Partial index over failed calls only; MySQL has no partial indexes, so it is skipped there
+        Index('ix_api_failed', 'user_id', 'timestamp',
+              postgresql_where=(column('success') == false()),
+              sqlite_where=(column('success') == false())).ddl_if(dialect=('postgresql', 'sqlite')),
+    )
 
 class ScheduleCache(db.Model):
     """Cache frequently used schedules and prompts"""
-    id = db.Column(db.Integer, primary_key=True)
-    cache_key = db.Column(db.String(255), unique=True, nullable=False)  # Hash of team config + rules
-    cached_data = db.Column(db.Text, nullable=False)  # JSON data
-    cache_type = db.Column(db.String(50))  # 'schedule', 'prompt', 'validation'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime)
-    hit_count = db.Column(db.Integer, default=0)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    cache_key: Mapped[bytes] = mapped_column(digest_type, unique=True)  # BLAKE2b-256 digest of team config
+    cached_data: Mapped[dict] = mapped_column(JSON)
+    cache_type: Mapped[Optional[str]] = mapped_column(Enum('schedule', 'prompt', 'validation', name='cache_type_enum'))
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+    expires_at: Mapped[Optional[datetime]]
+    hit_count: Mapped[Optional[int]] = mapped_column(default=0)
+
+    __table_args__ = (Index('ix_cache_expires', 'expires_at'),)
 
 class RuleViolation(db.Model):
     """Track specific rule violations for analysis"""
-    id = db.Column(db.Integer, primary_key=True)
-    team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
-    rule_number = db.Column(db.Integer, nullable=False)  # Which rule was violated
-    rule_description = db.Column(db.String(255))
-    violation_detail = db.Column(db.Text)  # Specific details of the violation
-    employee_affected = db.Column(db.String(150))
-    month_year = db.Column(db.String(20))
-    resolved = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    team = db.relationship('Team', backref='rule_violations')
+    id: Mapped[int] = mapped_column(primary_key=True)
+    team_id: Mapped[int] = mapped_column(ForeignKey('team.id', ondelete='CASCADE'))
+    rule_number: Mapped[int]  # Which rule was violated
+    rule_description: Mapped[Optional[str]] = mapped_column(String(255))
+    violation_detail: Mapped[Optional[str]] = mapped_column(Text)  # Specific details of the violation
+    employee_affected: Mapped[Optional[str]] = mapped_column(String(150))
+    month_year: Mapped[Optional[int]]  # Format: YYYYMM
+    resolved: Mapped[Optional[bool]] = mapped_column(default=False)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    team: Mapped['Team'] = relationship(back_populates='rule_violations')
+
+    __table_args__ = (
+        Index('ix_rv_team_month', 'team_id', 'month_year', 'resolved'),
+        # Partial index over open violations only; MySQL has no partial indexes, so it is skipped there
+        Index('ix_rv_unresolved', 'team_id', 'created_at',
+              postgresql_where=(column('resolved') == false()),
+              sqlite_where=(column('resolved') == false())).ddl_if(dialect=('postgresql', 'sqlite')),
+    )
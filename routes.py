@@ -1,21 +1,35 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app,
+                   make_response, session, abort)
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from marshmallow import Schema, fields, validate, ValidationError
-from sqlalchemy.orm import aliased
-from datetime import datetime, timedelta
-import json
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from email_validator import validate_email, EmailNotValidError
+from pydantic import BaseModel, ValidationError, field_validator
+from pydantic_core import PydanticCustomError
+from sqlalchemy import case, select
+from sqlalchemy.orm import aliased, selectinload, raiseload, undefer
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+import functools
+import hashlib
+import orjson
 import os
-from collections import defaultdict
+import time
+import uuid
+import redis
+from collections import Counter, OrderedDict, defaultdict
 
 # Import db object and models
-from app import db
-from models import (User, Designation, Employee, Team, TeamMember, SavedSchedule,
-                   EmployeeHistory, ScheduleValidationLog, APIUsageLog, RuleViolation)
+from app import db, redis_client
+from models import (User, Designation, Employee, EmployeeLeave, Team, TeamMember, SavedSchedule,
+                   ScheduleValidationLog, APIUsageLog, RuleViolation)
 
 # Import enhanced scheduler
 from scheduler import (generate_monthly_assignments_enhanced, validate_schedule_with_enhanced_ai, 
-                      fix_schedule_with_ai, SCHEDULING_RULES_TEXT)
+                      validate_schedule_in_background, validation_pending, get_cached_validation,
+                      fix_schedule_with_ai, cost_counter_keys, invalidate_cached_validations,
+                      SCHEDULING_RULES_TEXT, TEAM_SHIFTS_MAP)
 
 main_bp = Blueprint('main', __name__)
 
@@ -25,6 +39,12 @@ RATE_LIMITS = {
     'ai_validation': {'limit': 20, 'window': 3600},        # 20 validations per hour
     'schedule_fixes': {'limit': 5, 'window': 3600}         # 5 fixes per hour
 }
+# APIUsageLog.api_type recorded for each rate-limited action (used when counting from the database)
+RATE_LIMIT_API_TYPES = {
+    'schedule_generation': 'generate',
+    'ai_validation': 'validate',
+    'schedule_fixes': 'fix'
+}
 
 # Cost control thresholds
 COST_THRESHOLDS = {
@@ -33,43 +53,229 @@ COST_THRESHOLDS = {
     'warning_threshold': 0.8  # Warn at 80% of limit
 }
 
+# Cost-limit checks are memoized per process for a short time; a little staleness is acceptable
+COST_CHECK_TTL = 30  # seconds
+COST_CHECK_CACHE_SIZE = 1024
+# user_id -> (expires_at, result), in insertion order so the oldest entries expire first
+_cost_check_cache = OrderedDict()
+
+@dataclass(slots=True)
+class MemberView:
+    """Lightweight read-only projection of a team member"""
+    team_id: int
+    employee_id: int
+    name: str
+    email: str
+    title: str | None
+
+def load_member_views():
+    """Fetch all team members as MemberView rows grouped by team id, without ORM hydration"""
+    rows = db.session.execute(
+        select(
+            TeamMember.team_id,
+            Employee.id.label('employee_id'),
+            Employee.name,
+            Employee.email,
+            Designation.title
+        )
+        .join(Employee, Employee.id == TeamMember.employee_id)
+        .outerjoin(Designation, Designation.id == Employee.designation_id)
+        .order_by(TeamMember.id)
+    ).mappings().all()
+
+    members_by_team = defaultdict(list)
+    for row in rows:
+        members_by_team[row['team_id']].append(MemberView(**row))
+    return members_by_team
+
+# Argon2id password hashing; legacy Werkzeug pbkdf2 hashes are upgraded on login
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+def verify_password(user, password):
+    """Check a password against the stored hash, upgrading legacy or outdated hashes"""
+    if user.password.startswith('$argon2'):
+        try:
+            password_hasher.verify(user.password, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if password_hasher.check_needs_rehash(user.password):
+            user.password = password_hasher.hash(password)
+            db.session.commit()
+        return True
+
+    if not check_password_hash(user.password, password):
+        return False
+    user.password = password_hasher.hash(password)
+    db.session.commit()
+    return True
+
+def load_team_with_roster():
+    """Team query that eagerly loads members, employees and designations.
+
+    Any other lazy load on the team raises, so N+1 regressions fail loudly.
+    """
+    return Team.query.options(
+        selectinload(Team.members).joinedload(TeamMember.employee).joinedload(Employee.designation),
+        raiseload('*')
+    )
+
+def gender_counts(employee_ids, active_only=False):
+    """Map gender -> number of the given employees, counted in SQL"""
+    query = db.session.query(Employee.gender, db.func.count(Employee.id)).filter(Employee.id.in_(employee_ids))
+    if active_only:
+        query = query.filter(Employee.is_active == True)
+    return dict(query.group_by(Employee.gender).all())
+
+def parse_leave_date(value):
+    """Parse a "YYYY-MM-DD" leave date (raises ValueError)"""
+    # Zero-padded dates take the C-implemented fromisoformat; anything else (e.g. "2025-1-5")
+    # falls back to strptime, which accepts unpadded months and days
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return date.fromisoformat(value)
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+def leave_month_counts(leave_dates):
+    """Map "YYYY-MM" -> number of distinct leave days in that month"""
+    return Counter(f"{d.year}-{d.month:02d}" for d in set(leave_dates))
+
+def sync_leave_dates(employee, leave_dates):
+    """Make the employee's EmployeeLeave rows match the given dates"""
+    wanted = set(leave_dates)
+    for leave in list(employee.leaves):
+        if leave.leave_date not in wanted:
+            employee.leaves.remove(leave)
+    existing = {leave.leave_date for leave in employee.leaves}
+    for leave_date in sorted(wanted - existing):
+        employee.leaves.append(EmployeeLeave(leave_date=leave_date))
+
+def latest_per_team(model, order_column, limit, team_ids):
+    """Map team_id -> the newest `limit` rows of `model` for that team, newest first"""
+    ranked = select(
+        model,
+        db.func.row_number().over(partition_by=model.team_id, order_by=order_column.desc()).label('rn')
+    ).where(model.team_id.in_(team_ids)).subquery()
+    entity = aliased(model, ranked)
+    rows = db.session.execute(
+        select(entity).where(ranked.c.rn <= limit).order_by(ranked.c.team_id, ranked.c.rn)
+    ).scalars()
+    
+    rows_by_team = defaultdict(list)
+    for row in rows:
+        rows_by_team[row.team_id].append(row)
+    return rows_by_team
+
 def check_rate_limit(user_id, action_type):
     """Check if user has exceeded rate limits"""
     if action_type not in RATE_LIMITS:
         return True, "Unknown action type"
     
     limit_config = RATE_LIMITS[action_type]
-    window_start = datetime.utcnow() - timedelta(seconds=limit_config['window'])
     
-    # Count recent API calls
-    recent_calls = APIUsageLog.query.filter(
-        APIUsageLog.user_id == user_id,
-        APIUsageLog.api_type == action_type,
-        APIUsageLog.timestamp >= window_start
-    ).count()
+    # Rolling window kept in a Redis sorted set scored by timestamp
+    now = time.time()
+    key = f"rate:{user_id}:{action_type}"
+    member = f"{now}:{uuid.uuid4().hex}"
+    try:
+        pipe = redis_client.pipeline()
+        pipe.zremrangebyscore(key, 0, now - limit_config['window'])
+        pipe.zadd(key, {member: now})
+        pipe.zcard(key)
+        pipe.expire(key, limit_config['window'])
+        recent_calls = pipe.execute()[2] - 1  # Exclude this call
+        if recent_calls >= limit_config['limit']:
+            redis_client.zrem(key, member)  # Rejected calls don't use up the window
+    except redis.RedisError:
+        # Fall back to counting recent API calls in the database
+        window_start = datetime.utcnow() - timedelta(seconds=limit_config['window'])
+        recent_calls = APIUsageLog.query.filter(
+            APIUsageLog.user_id == user_id,
+            APIUsageLog.api_type == RATE_LIMIT_API_TYPES[action_type],
+            APIUsageLog.timestamp >= window_start
+        ).count()
     
     if recent_calls >= limit_config['limit']:
         return False, f"Rate limit exceeded. Maximum {limit_config['limit']} {action_type} calls per hour."
     
     return True, f"{recent_calls}/{limit_config['limit']} calls used in current window"
 
-def check_cost_limits(user_id):
-    """Check if user has exceeded cost thresholds"""
+@functools.lru_cache(maxsize=2)
+def _boundaries(day_ordinal):
+    """(day_start, month_start) datetimes for the given proleptic ordinal day"""
+    day = date.fromordinal(day_ordinal)
+    day_start = datetime(day.year, day.month, day.day)
+    return day_start, day_start.replace(day=1)
+
+def get_user_costs(user_id):
+    """Return (daily_cost, monthly_cost) from the Redis counters, rehydrating misses from APIUsageLog"""
     now = datetime.utcnow()
+    day_start, month_start = _boundaries(now.toordinal())
+    counter_keys = cost_counter_keys(user_id, now)
     
-    # Check daily costs
-    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    daily_cost = db.session.query(db.func.sum(APIUsageLog.cost_estimate)).filter(
-        APIUsageLog.user_id == user_id,
-        APIUsageLog.timestamp >= day_start
-    ).scalar() or 0.0
+    try:
+        cached = redis_client.mget([key for key, _ in counter_keys])
+    except redis.RedisError:
+        cached = [None, None]
     
-    # Check monthly costs
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    monthly_cost = db.session.query(db.func.sum(APIUsageLog.cost_estimate)).filter(
-        APIUsageLog.user_id == user_id,
-        APIUsageLog.timestamp >= month_start
-    ).scalar() or 0.0
+    costs = []
+    for (key, ttl), start, value in zip(counter_keys, (day_start, month_start), cached):
+        if value is not None:
+            costs.append(float(value))
+            continue
+        total = db.session.query(db.func.sum(APIUsageLog.cost_estimate)).filter(
+            APIUsageLog.user_id == user_id,
+            APIUsageLog.timestamp >= start
+        ).scalar() or 0.0
+        try:
+            redis_client.set(key, total, ex=ttl, nx=True)
+        except redis.RedisError:
+            pass
+        costs.append(total)
+    
+    return costs[0], costs[1]
+
+def pre_flight(user_id, action_type, team_id=None):
+    """Run the cost-limit, existing-schedule and rate-limit checks before an AI call.
+
+    Returns (message, category) for flashing, or (None, None) when the call may
+    proceed. The memoized cost check and the EXISTS probe run first
+    so a rejected request never takes a slot in the rate window.
+    """
+    cost_ok, cost_message = check_cost_limits(user_id)
+    if not cost_ok:
+        return cost_message, 'danger'
+    
+    if team_id is not None and db.session.query(db.exists().where(SavedSchedule.team_id == team_id)).scalar():
+        return "A schedule for this team already exists. Delete it first to generate a new one.", 'warning'
+    
+    rate_ok, rate_message = check_rate_limit(user_id, action_type)
+    if not rate_ok:
+        return rate_message, 'danger'
+    return None, None
+
+def check_cost_limits(user_id):
+    """Check if user has exceeded cost thresholds (memoized for COST_CHECK_TTL seconds)"""
+    cached = _cost_check_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    
+    result = _evaluate_cost_limits(user_id)
+    now = time.monotonic()
+    _cost_check_cache.pop(user_id, None)
+    _cost_check_cache[user_id] = (now + COST_CHECK_TTL, result)
+    # Every entry has the same TTL, so expired ones sit at the front; also cap the size
+    while _cost_check_cache:
+        oldest_user, (expires_at, _) = next(iter(_cost_check_cache.items()))
+        if expires_at > now and len(_cost_check_cache) <= COST_CHECK_CACHE_SIZE:
+            break
+        del _cost_check_cache[oldest_user]
+    return result
+
+def invalidate_cost_limits(user_id):
+    """Drop the memoized cost check after the user incurs new API usage"""
+    _cost_check_cache.pop(user_id, None)
+
+def _evaluate_cost_limits(user_id):
+    daily_cost, monthly_cost = get_user_costs(user_id)
     
     # Check limits
     if daily_cost >= COST_THRESHOLDS['daily_limit']:
@@ -91,15 +297,29 @@ def check_cost_limits(user_id):
 #----------------------------------------------------------------------------#
 # User Authentication Routes (unchanged from original)
 #----------------------------------------------------------------------------#
-class UserSchema(Schema):
-    username = fields.Str(required=True, validate=validate.Length(min=3, error="Username must be at least 3 characters."))
-    email = fields.Email(required=True, error_messages={
-        "required": "Email is required.",
-        "invalid": "Please enter a valid email ID."
-    })
-    password = fields.Str(required=True, load_only=True)
-
-user_schema = UserSchema()
+class UserForm(BaseModel):
+    """Signup form fields; username and email are stored lower-cased to match the case-insensitive login"""
+    username: str
+    email: str
+    password: str
+
+    @field_validator('username')
+    @classmethod
+    def check_username(cls, value):
+        value = value.strip().lower()
+        if len(value) < 3:
+            raise PydanticCustomError('username_length', "Username must be at least 3 characters.")
+        return value
+
+    @field_validator('email')
+    @classmethod
+    def check_email(cls, value):
+        value = value.strip().lower()
+        try:
+            validate_email(value, check_deliverability=False)
+        except EmailNotValidError:
+            raise PydanticCustomError('email_invalid', "Please enter a valid email ID.")
+        return value
 
 @main_bp.route('/')
 def home():
@@ -115,21 +335,21 @@ def signup():
         }
 
         try:
-            validated = user_schema.load(data)
+            validated = UserForm.model_validate(data).model_dump()
         except ValidationError as err:
-            for msg in err.messages.values():
-                flash(msg[0], 'danger')
+            for error in err.errors():
+                flash(error['msg'], 'danger')
             return redirect(url_for('main.signup'))
 
-        if User.query.filter_by(email=validated['email']).first():
+        if db.session.query(db.exists().where(db.func.lower(User.email) == validated['email'])).scalar():
             flash('This email ID is already registered.', 'danger')
             return redirect(url_for('main.signup'))
 
-        if User.query.filter_by(username=validated['username']).first():
+        if db.session.query(db.exists().where(db.func.lower(User.username) == validated['username'])).scalar():
             flash('This username is already taken.', 'danger')
             return redirect(url_for('main.signup'))
 
-        hashed_pw = generate_password_hash(validated['password'])
+        hashed_pw = password_hasher.hash(validated['password'])
         user = User(username=validated['username'], email=validated['email'], password=hashed_pw)
         db.session.add(user)
         db.session.commit()
@@ -141,15 +361,18 @@ def signup():
 @main_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        identifier = request.form['identifier']
+        identifier = request.form['identifier'].strip().lower()
         password = request.form['password']
-        user = User.query.filter((User.email == identifier) | (User.username == identifier)).first()
+        # Case-insensitive match, served by the lower(email) / lower(username) indexes
+        user = User.query.options(undefer(User.password)).filter(
+            (db.func.lower(User.email) == identifier) | (db.func.lower(User.username) == identifier)
+        ).first()
 
         if not user:
             flash('User not found. Please check your email or username.', 'danger')
             return redirect(url_for('main.login'))
 
-        if not check_password_hash(user.password, password):
+        if not verify_password(user, password):
             flash('Incorrect password.', 'danger')
             return redirect(url_for('main.login'))
 
@@ -162,22 +385,7 @@ def login():
 @login_required
 def dashboard():
     # Show cost usage summary on dashboard
-    user_id = current_user.id
-    now = datetime.utcnow()
-    
-    # Get current usage stats
-    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    daily_cost = db.session.query(db.func.sum(APIUsageLog.cost_estimate)).filter(
-        APIUsageLog.user_id == user_id,
-        APIUsageLog.timestamp >= day_start
-    ).scalar() or 0.0
-    
-    monthly_cost = db.session.query(db.func.sum(APIUsageLog.cost_estimate)).filter(
-        APIUsageLog.user_id == user_id,
-        APIUsageLog.timestamp >= month_start
-    ).scalar() or 0.0
+    daily_cost, monthly_cost = get_user_costs(current_user.id)
     
     usage_stats = {
         'daily_cost': daily_cost,
@@ -213,11 +421,11 @@ def add_designation():
             flash('Hierarchy must be a number.', 'danger')
             return redirect(url_for('main.add_designation'))
 
-        if Designation.query.filter_by(title=title).first():
+        if db.session.query(db.exists().where(Designation.title == title)).scalar():
             flash('This designation title already exists.', 'danger')
             return redirect(url_for('main.add_designation'))
 
-        if Designation.query.filter_by(hierarchy_level=hierarchy_level).first():
+        if db.session.query(db.exists().where(Designation.hierarchy_level == hierarchy_level)).scalar():
             flash(f'Hierarchy level {hierarchy_level} is already assigned.', 'danger')
             return redirect(url_for('main.add_designation'))
 
@@ -248,26 +456,29 @@ def manage_designation():
                 flash(f'Designation "{designation_to_delete.title}" deleted.', 'info')
                 return redirect(url_for('main.manage_designation'))
 
-        # Validation for bulk updates
-        new_titles = []
-        new_hierarchies = []
+        # Parse and validate the bulk update in a single pass
+        updates = []
+        new_titles = set()
+        new_hierarchies = set()
         for desig in designations:
-            new_title = request.form.get(f"title_{desig.id}").strip()
-            new_hierarchy = int(request.form.get(f"hierarchy_{desig.id}"))
+            new_title = request.form[f"title_{desig.id}"].strip().title()
+            new_hierarchy = int(request.form[f"hierarchy_{desig.id}"])
             if new_title in new_titles:
                 flash(f'Duplicate designation title "{new_title}" found.', 'danger')
                 return redirect(url_for('main.manage_designation'))
-            new_titles.append(new_title)
+            new_titles.add(new_title)
             if new_hierarchy in new_hierarchies:
                 flash(f'Duplicate hierarchy level "{new_hierarchy}" found.', 'danger')
                 return redirect(url_for('main.manage_designation'))
-            new_hierarchies.append(new_hierarchy)
-
-        for desig in designations:
-            desig.title = request.form.get(f"title_{desig.id}").strip().title()
-            desig.hierarchy_level = int(request.form.get(f"hierarchy_{desig.id}"))
-            desig.monthly_leave_allowance = int(request.form.get(f"leave_{desig.id}"))
+            new_hierarchies.add(new_hierarchy)
+            updates.append({
+                'id': desig.id,
+                'title': new_title,
+                'hierarchy_level': new_hierarchy,
+                'monthly_leave_allowance': int(request.form[f"leave_{desig.id}"])
+            })
 
+        db.session.bulk_update_mappings(Designation, updates)
         db.session.commit()
         flash('Changes saved successfully.', 'success')
         return redirect(url_for('main.manage_designation'))
@@ -296,45 +507,41 @@ def add_employee():
         designation_id = int(request.form['designation_id'])
         leave_dates_raw = request.form.get('leave_dates', '')
 
-        if Employee.query.filter_by(email=email).first():
+        if db.session.query(db.exists().where(Employee.email == email)).scalar():
             flash('An employee with this email already exists.', 'danger')
             return redirect(url_for('main.add_employee'))
 
         leave_dates_list = [d.strip() for d in leave_dates_raw.split(',') if d.strip()]
-        today = datetime.today().date()
+        today = date.today()
         parsed_dates = []
         for d in leave_dates_list:
             try:
-                parsed = datetime.strptime(d, "%Y-%m-%d").date()
-                if parsed < today:
-                    flash(f"Leave date {d} is in the past.", "danger")
-                    return redirect(url_for('main.add_employee'))
-                parsed_dates.append(parsed)
+                parsed = parse_leave_date(d)
             except ValueError:
                 flash(f"Invalid date format: {d}", "danger")
                 return redirect(url_for('main.add_employee'))
+            if parsed < today:
+                flash(f"Leave date {d} is in the past.", "danger")
+                return redirect(url_for('main.add_employee'))
+            parsed_dates.append(parsed)
 
         designation = Designation.query.get(designation_id)
         max_allowed = designation.monthly_leave_allowance if designation else 0
-        month_count = defaultdict(int)
-        for date in parsed_dates:
-            key = (date.year, date.month)
-            month_count[key] += 1
-        for (year, month), count in month_count.items():
+        month_count = leave_month_counts(parsed_dates)
+        for month, count in month_count.items():
             if count > max_allowed:
-                flash(f"Too many leaves in {year}-{month:02d}. Max allowed is {max_allowed}.", "danger")
+                flash(f"Too many leaves in {month}. Max allowed is {max_allowed}.", "danger")
                 return redirect(url_for('main.add_employee'))
 
-        leave_dates_json = json.dumps([d.strftime("%Y-%m-%d") for d in parsed_dates])
         employee = Employee(
             name=name,
             email=email,
             gender=gender,
             designation_id=designation_id,
             shift_preference=request.form.get('shift_preference') or None,
-            leave_dates=leave_dates_json,
             is_active=True  # New field
         )
+        sync_leave_dates(employee, parsed_dates)
         db.session.add(employee)
         db.session.commit()
         flash('Employee added successfully!', 'success')
@@ -344,7 +551,7 @@ def add_employee():
 @main_bp.route('/employees/manage', methods=['GET', 'POST'])
 @login_required
 def manage_employees():
-    employees = Employee.query.all()
+    employees = Employee.query.options(selectinload(Employee.leaves)).all()
     designations = Designation.query.all()
     if request.method == 'POST':
         emp_id = int(request.form['emp_id'])
@@ -369,31 +576,29 @@ def manage_employees():
         employee.shift_preference = request.form.get('shift_preference') or None
         raw_dates = request.form.get('leave_dates', '')
         leave_list = [d.strip() for d in raw_dates.split(',') if d.strip()]
-        today = datetime.today().date()
+        today = date.today()
+        parsed_dates = []
         for d in leave_list:
-            parsed = datetime.strptime(d, "%Y-%m-%d").date()
+            try:
+                parsed = parse_leave_date(d)
+            except ValueError:
+                flash(f"Invalid date format: {d}", "danger")
+                return redirect(url_for('main.manage_employees'))
             if parsed < today:
                 flash('Leave date in the past: {}'.format(d), 'danger')
                 return redirect(url_for('main.manage_employees'))
-        month_map = {}
-        for d in leave_list:
-            month_key = d[:7]
-            month_map[month_key] = month_map.get(month_key, 0) + 1
+            parsed_dates.append(parsed)
+        month_map = leave_month_counts(parsed_dates)
         max_allowed = Designation.query.get(employee.designation_id).monthly_leave_allowance
         for month, count in month_map.items():
             if count > max_allowed:
                 flash(f'Maximum leaves reached in {month}. Allowed: {max_allowed}', 'danger')
                 return redirect(url_for('main.manage_employees'))
-        employee.leave_dates = json.dumps(leave_list)
+        sync_leave_dates(employee, parsed_dates)
         db.session.commit()
         flash('Changes saved successfully.', 'success')
         return redirect(url_for('main.manage_employees'))
     
-    for emp in employees:
-        try:
-            emp.leave_dates_formatted = json.loads(emp.leave_dates or '[]')
-        except:
-            emp.leave_dates_formatted = []
     return render_template('employee_manage.html', employees=employees, designations=designations)
 
 # Team management routes (keeping existing functionality)
@@ -401,14 +606,15 @@ def manage_employees():
 @login_required
 def view_teams():
     teams = Team.query.all()
-    return render_template('team_dashboard.html', teams=teams)
+    return render_template('team_dashboard.html', teams=teams, members_by_team=load_member_views())
 
 @main_bp.route('/team/add', methods=['GET', 'POST'])
 @login_required
 def add_team():
     TeamMemberAlias = aliased(TeamMember)
+    # Only the columns the form renders; skips the designation join and legacy leave_dates text
     unassigned_employees = (
-        db.session.query(Employee)
+        db.session.query(Employee.id, Employee.name, Employee.email, Employee.gender)
         .outerjoin(TeamMemberAlias, Employee.id == TeamMemberAlias.employee_id)
         .filter(TeamMemberAlias.employee_id == None, Employee.is_active == True)  # Only active employees
         .all()
@@ -423,7 +629,7 @@ def add_team():
         shift_count = shift_map.get(template, 0)
         required_min_members = shift_count * people
         
-        if Team.query.filter_by(name=name).first():
+        if db.session.query(db.exists().where(Team.name == name)).scalar():
             flash('A team with this name already exists.', 'danger')
             return redirect(url_for('main.add_team'))
             
@@ -431,9 +637,8 @@ def add_team():
             flash(f"A minimum of {required_min_members} employees required for {template} template with {people} people/shift.", 'danger')
             return redirect(url_for('main.add_team'))
             
-        selected_employees = Employee.query.filter(Employee.id.in_(member_ids)).all()
-        male_count = sum(1 for e in selected_employees if e.gender == 'Male')
-        female_count = sum(1 for e in selected_employees if e.gender == 'Female')
+        counts = gender_counts(member_ids)
+        male_count, female_count = counts.get('Male', 0), counts.get('Female', 0)
         
         if male_count < 2 or female_count < 2:
             flash('A team must include at least 2 members from each gender (minimum 2 males and 2 females).', 'danger')
@@ -441,10 +646,10 @@ def add_team():
             
         team = Team(name=name, shift_template=template, people_per_shift=people)
         db.session.add(team)
-        db.session.commit()
+        db.session.flush()  # Assigns team.id
         
-        for eid in member_ids:
-            db.session.add(TeamMember(team_id=team.id, employee_id=eid))
+        db.session.execute(TeamMember.__table__.insert(),
+                           [{'team_id': team.id, 'employee_id': eid} for eid in member_ids])
         db.session.commit()
         
         flash('Team added successfully.', 'success')
@@ -456,20 +661,22 @@ def add_team():
 @login_required
 def manage_teams():
     teams = Team.query.all()
-    team_members_map = {team.id: {m.employee_id for m in team.members if m.employee.is_active} for team in teams}
+    # Active memberships as (team_id, employee_id) tuples rather than TeamMember/Employee objects
+    team_members_map = defaultdict(set)
+    for team_id, employee_id in (
+        db.session.query(TeamMember.team_id, TeamMember.employee_id)
+        .join(Employee, TeamMember.employee_id == Employee.id)
+        .filter(Employee.is_active == True)
+    ):
+        team_members_map[team_id].add(employee_id)
     
     if request.method == 'POST':
         if request.form['action'] == 'delete':
             team_id = int(request.form['team_id'])
-            team = Team.query.get(team_id)
-            if team:
-                # Delete related schedules and history
-                SavedSchedule.query.filter_by(team_id=team_id).delete()
-                EmployeeHistory.query.filter_by(team_id=team_id).delete()
-                for tm in team.members:
-                    db.session.delete(tm)
-                db.session.delete(team)
+            # Members, schedules, history and logs go with the team via ON DELETE CASCADE
+            if db.session.execute(Team.__table__.delete().where(Team.id == team_id)).rowcount:
                 db.session.commit()
+                invalidate_cached_validations(team_id)
                 flash('Team and all associated data deleted successfully.', 'info')
             return redirect(url_for('main.manage_teams'))
             
@@ -492,29 +699,36 @@ def manage_teams():
             flash(f'You must select at least {required_min} members for {team.shift_template} with {team.people_per_shift} people per shift.', 'danger')
             return redirect(url_for('main.manage_teams'))
             
-        selected_emps = Employee.query.filter(Employee.id.in_(selected_ids), Employee.is_active == True).all()
-        male_count = sum(1 for e in selected_emps if e.gender == 'Male')
-        female_count = sum(1 for e in selected_emps if e.gender == 'Female')
+        counts = gender_counts(selected_ids, active_only=True)
+        male_count, female_count = counts.get('Male', 0), counts.get('Female', 0)
         
         if male_count < 2 and female_count < 2:
             flash('A team must include at least 2 members of the opposite gender.', 'danger')
             return redirect(url_for('main.manage_teams'))
             
         current_ids = {m.employee_id for m in team.members}
-        for emp_id in selected_ids - current_ids:
-            db.session.add(TeamMember(team_id=team.id, employee_id=emp_id))
-        for tm in team.members[:]:
-            if tm.employee_id not in selected_ids:
-                db.session.delete(tm)
+        added_ids = selected_ids - current_ids
+        removed_ids = current_ids - selected_ids
+        if added_ids:
+            db.session.execute(TeamMember.__table__.insert(),
+                               [{'team_id': team.id, 'employee_id': emp_id} for emp_id in added_ids])
+        if removed_ids:
+            db.session.execute(TeamMember.__table__.delete().where(
+                TeamMember.team_id == team.id, TeamMember.employee_id.in_(removed_ids)))
         db.session.commit()
         flash('Team updated successfully.', 'success')
         return redirect(url_for('main.manage_teams'))
     
+    # An employee is available to a team unless an active membership exists in some other team
+    active_employees = db.session.query(Employee.id, Employee.name, Employee.email).filter(Employee.is_active == True).all()
+    assignment_counts = Counter(emp_id for member_ids in team_members_map.values() for emp_id in member_ids)
     employee_map = {}
     for team in teams:
-        all_assigned_ids = {m.employee_id for t in teams for m in t.members if t.id != team.id and m.employee.is_active}
-        available_emps = Employee.query.filter(~Employee.id.in_(all_assigned_ids), Employee.is_active == True).all()
-        employee_map[team.id] = available_emps
+        own_ids = team_members_map[team.id]
+        employee_map[team.id] = [
+            e for e in active_employees
+            if assignment_counts[e.id] - (e.id in own_ids) == 0
+        ]
         
     return render_template('team_manage.html', teams=teams, employee_map=employee_map, team_members_map=team_members_map)
 
@@ -525,12 +739,15 @@ def manage_teams():
 @main_bp.route('/generate_schedule', methods=['GET', 'POST'])
 @login_required
 def generate_schedule():
-    teams = Team.query.all()
+    # Member counts for the picker, and active flags for the selected team
+    teams = Team.query.options(selectinload(Team.members).selectinload(TeamMember.employee)).all()
     selected_team = None
     schedule_by_month = None
     schedule_exists = False
     ai_validation_report = None
+    ai_validation_pending = False
     cost_warnings = []
+    etag = None
     
     # Check cost limits
     cost_ok, cost_message = check_cost_limits(current_user.id)
@@ -547,45 +764,52 @@ def generate_schedule():
             if selected_team:
                 saved_schedule = SavedSchedule.query.filter_by(team_id=team_id).first()
                 if saved_schedule:
-                    schedule_by_month = json.loads(saved_schedule.schedule_data)
+                    schedule_by_month = saved_schedule.schedule_data
                     schedule_exists = True
                     
-                    # Enhanced validation with historical context
+                    # Show an earlier validation of this exact schedule; otherwise validate in the background
+                    ai_validation_report = get_cached_validation(saved_schedule.schedule_data, team_id)
                     api_key = os.getenv('GEMINI_API_KEY')
-                    if api_key:
-                        ai_validation_report = validate_schedule_with_enhanced_ai(
-                            saved_schedule.schedule_data, team_id, api_key
+                    if ai_validation_report is None and api_key:
+                        validate_schedule_in_background(
+                            current_app._get_current_object(), saved_schedule.schedule_data, team_id, api_key
                         )
+                        ai_validation_pending = True
+                    
+                    # Fingerprint of everything the page shows, so unchanged refreshes get a 304
+                    etag = hashlib.sha256(orjson.dumps([
+                        current_user.id, team_id, saved_schedule.updated_at,
+                        [(team.id, team.name, team.shift_template, team.people_per_shift, len(team.members))
+                         for team in teams],
+                        sum(1 for m in selected_team.members if m.employee.is_active),
+                        cost_warnings, ai_validation_report, ai_validation_pending
+                    ], option=orjson.OPT_NON_STR_KEYS)).hexdigest()
+                    # Pending flash messages must still be rendered
+                    if request.if_none_match.contains(etag) and not session.get('_flashes'):
+                        response = make_response('', 304)
+                        response.set_etag(etag)
+                        return response
 
     # Handle new schedule generation with enhanced controls
     if request.method == 'POST':
         team_id = int(request.form['team_id'])
         months = int(request.form.get('months', 1))
-        selected_team = Team.query.get(team_id)
-
-        # Check rate limits
-        rate_ok, rate_message = check_rate_limit(current_user.id, 'generate')
-        if not rate_ok:
-            flash(rate_message, 'danger')
-            return redirect(url_for('main.generate_schedule', team_id=team_id))
+        selected_team = load_team_with_roster().filter_by(id=team_id).first()
 
-        # Check cost limits
-        cost_ok, cost_message = check_cost_limits(current_user.id)
-        if not cost_ok:
-            flash(cost_message, 'danger')
-            return redirect(url_for('main.generate_schedule', team_id=team_id))
-
-        if SavedSchedule.query.filter_by(team_id=team_id).first():
-            flash("A schedule for this team already exists. Delete it first to generate a new one.", "warning")
+        # Cost, existing-schedule and rate checks
+        error, category = pre_flight(current_user.id, 'generate', team_id)
+        if error:
+            flash(error, category)
             return redirect(url_for('main.generate_schedule', team_id=team_id))
 
         # Generate schedule with enhanced state management
         schedule_by_month = generate_monthly_assignments_enhanced(selected_team, months, current_user.id)
+        invalidate_cost_limits(current_user.id)
 
         if schedule_by_month:
             new_schedule = SavedSchedule(
                 team_id=team_id,
-                schedule_data=json.dumps(schedule_by_month)
+                schedule_data=schedule_by_month
             )
             db.session.add(new_schedule)
             db.session.commit()
@@ -594,34 +818,39 @@ def generate_schedule():
         else:
             flash("Failed to generate schedule. Please check team configuration and try again.", "danger")
 
-    return render_template(
+    response = make_response(render_template(
         'generate_schedule_enhanced.html',
         teams=teams,
         selected_team=selected_team,
         schedule_by_month=schedule_by_month,
         schedule_exists=schedule_exists,
         ai_validation_report=ai_validation_report,
+        ai_validation_pending=ai_validation_pending,
         cost_warnings=cost_warnings,
         months=1
-    )
+    ))
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@main_bp.route('/schedule_validation/<int:team_id>')
+@login_required
+def schedule_validation(team_id):
+    """Latest validation report for a team's schedule, polled while AI validation runs"""
+    saved_schedule = SavedSchedule.query.filter_by(team_id=team_id).first()
+    if not saved_schedule:
+        return jsonify({'error': 'No schedule found for this team.'}), 404
+    return jsonify({
+        'pending': validation_pending(team_id),
+        'report': get_cached_validation(saved_schedule.schedule_data, team_id)
+    })
 
 @main_bp.route('/fix_schedule/<int:team_id>', methods=['POST'])
 @login_required
 def fix_schedule(team_id):
     """Enhanced schedule fixing with rate limiting"""
     
-    # Check rate limits
-    rate_ok, rate_message = check_rate_limit(current_user.id, 'schedule_fixes')
-    if not rate_ok:
-        flash(rate_message, 'danger')
-        return redirect(url_for('main.generate_schedule', team_id=team_id))
-    
-    # Check cost limits
-    cost_ok, cost_message = check_cost_limits(current_user.id)
-    if not cost_ok:
-        flash(cost_message, 'danger')
-        return redirect(url_for('main.generate_schedule', team_id=team_id))
-
     api_key = os.getenv('GEMINI_API_KEY')
     if not api_key:
         flash("GEMINI_API_KEY not found in environment.", "danger")
@@ -632,6 +861,12 @@ def fix_schedule(team_id):
         flash("No schedule found to fix.", "danger")
         return redirect(url_for('main.generate_schedule', team_id=team_id))
 
+    # Cost and rate checks, after the checks that never reach the AI so those don't use up a slot
+    error, category = pre_flight(current_user.id, 'schedule_fixes')
+    if error:
+        flash(error, category)
+        return redirect(url_for('main.generate_schedule', team_id=team_id))
+
     # Re-validate with enhanced validation
     validation_report = validate_schedule_with_enhanced_ai(
         saved_schedule.schedule_data, team_id, api_key
@@ -639,6 +874,7 @@ def fix_schedule(team_id):
     violations = validation_report.get('violations', [])
 
     if not violations:
+        db.session.commit()  # Validation log
         flash("No violations found, schedule is already valid.", "info")
         return redirect(url_for('main.generate_schedule', team_id=team_id))
 
@@ -653,18 +889,19 @@ def fix_schedule(team_id):
     if success:
         # Validate the corrected schedule
         corrected_validation = validate_schedule_with_enhanced_ai(
-            json.dumps(corrected_schedule), team_id, api_key
+            corrected_schedule, team_id, api_key
         )
         
         if corrected_validation.get('is_valid', False):
-            saved_schedule.schedule_data = json.dumps(corrected_schedule)
-            db.session.commit()
+            saved_schedule.schedule_data = corrected_schedule
             flash("Schedule successfully corrected by AI and validated!", "success")
         else:
             flash("AI correction partially successful but still has some violations. Manual review recommended.", "warning")
     else:
         flash(f"AI correction failed: {corrected_schedule.get('error', 'Unknown error')}", "danger")
 
+    # Validation logs, rule violations and any corrected schedule in one transaction
+    db.session.commit()
     return redirect(url_for('main.generate_schedule', team_id=team_id))
 
 @main_bp.route('/schedule_analytics')
@@ -673,26 +910,25 @@ def schedule_analytics():
     """New route for viewing schedule analytics and violations"""
     
     # Get user's teams
-    user_teams = Team.query.all()  # In a real app, filter by user's teams
+    user_teams = Team.query.options(selectinload(Team.members)).all()  # In a real app, filter by user's teams
+    
+    # Latest rows per team, one windowed query per table
+    team_ids = [team.id for team in user_teams]
+    violations = latest_per_team(RuleViolation, RuleViolation.created_at, 10, team_ids)
+    validation_logs = latest_per_team(ScheduleValidationLog, ScheduleValidationLog.validated_at, 5, team_ids)
+    api_usage = latest_per_team(APIUsageLog, APIUsageLog.timestamp, 10, team_ids)
     
     analytics_data = {}
     for team in user_teams:
-        # Get violation history
-        violations = RuleViolation.query.filter_by(team_id=team.id).order_by(RuleViolation.created_at.desc()).limit(10).all()
-        
-        # Get validation logs
-        validation_logs = ScheduleValidationLog.query.filter_by(team_id=team.id).order_by(ScheduleValidationLog.validated_at.desc()).limit(5).all()
-        
-        # Get API usage for this team
-        api_usage = APIUsageLog.query.filter_by(team_id=team.id).order_by(APIUsageLog.timestamp.desc()).limit(10).all()
-        
+        team_violations = violations[team.id]
+        team_logs = validation_logs[team.id]
         analytics_data[team.id] = {
             'team': team,
-            'violations': violations,
-            'validation_logs': validation_logs,
-            'api_usage': api_usage,
-            'total_violations': len(violations),
-            'last_validation': validation_logs[0] if validation_logs else None
+            'violations': team_violations,
+            'validation_logs': team_logs,
+            'api_usage': api_usage[team.id],
+            'total_violations': len(team_violations),
+            'last_validation': team_logs[0] if team_logs else None
         }
     
     return render_template('schedule_analytics.html', analytics_data=analytics_data)
@@ -706,28 +942,37 @@ def api_usage_report():
     now = datetime.utcnow()
     
     # Get usage for different time periods
-    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_start, month_start = _boundaries(now.toordinal())
     week_start = now - timedelta(days=7)
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    
+    # One pass over the widest window, with conditional aggregates per period and api_type
+    periods = [('today', day_start), ('week', week_start), ('month', month_start)]
+    columns = [APIUsageLog.api_type]
+    for period, start_date in periods:
+        in_period = APIUsageLog.timestamp >= start_date
+        columns += [
+            db.func.sum(case((in_period, 1), else_=0)),
+            db.func.sum(case((in_period, db.func.coalesce(APIUsageLog.cost_estimate, 0.0)), else_=0.0)),
+            db.func.sum(case((in_period, db.func.coalesce(APIUsageLog.tokens_used, 0)), else_=0)),
+        ]
+    rows = db.session.query(*columns).filter(
+        APIUsageLog.user_id == user_id,
+        APIUsageLog.timestamp >= min(start_date for _, start_date in periods)
+    ).group_by(APIUsageLog.api_type).all()
     
     usage_summary = {}
-    for period, start_date in [('today', day_start), ('week', week_start), ('month', month_start)]:
-        usage = APIUsageLog.query.filter(
-            APIUsageLog.user_id == user_id,
-            APIUsageLog.timestamp >= start_date
-        ).all()
-        
+    for index, (period, _) in enumerate(periods):
+        by_type = {}
+        for row in rows:
+            calls, cost, tokens = row[1 + 3 * index:4 + 3 * index]
+            if calls:
+                by_type[row[0]] = {'calls': calls, 'cost': cost, 'tokens': tokens}
         usage_summary[period] = {
-            'total_calls': len(usage),
-            'total_cost': sum(u.cost_estimate for u in usage),
-            'total_tokens': sum(u.tokens_used for u in usage),
-            'by_type': defaultdict(lambda: {'calls': 0, 'cost': 0.0, 'tokens': 0})
+            'total_calls': sum(usage['calls'] for usage in by_type.values()),
+            'total_cost': sum((usage['cost'] for usage in by_type.values()), 0.0),
+            'total_tokens': sum(usage['tokens'] for usage in by_type.values()),
+            'by_type': by_type
         }
-        
-        for u in usage:
-            usage_summary[period]['by_type'][u.api_type]['calls'] += 1
-            usage_summary[period]['by_type'][u.api_type]['cost'] += u.cost_estimate
-            usage_summary[period]['by_type'][u.api_type]['tokens'] += u.tokens_used
     
     return render_template('api_usage_report.html', 
                          usage_summary=usage_summary,
@@ -738,14 +983,13 @@ def api_usage_report():
 @login_required
 def delete_schedule(team_id):
     """Enhanced schedule deletion with cleanup"""
-    schedule_to_delete = SavedSchedule.query.filter_by(team_id=team_id).first()
-    if schedule_to_delete:
+    # Bulk DELETEs; the schedule row (and its JSON payload) is never loaded
+    if SavedSchedule.query.filter_by(team_id=team_id).delete(synchronize_session=False):
         # Clean up related data
-        ScheduleValidationLog.query.filter_by(team_id=team_id).delete()
-        RuleViolation.query.filter_by(team_id=team_id).delete()
-        
-        db.session.delete(schedule_to_delete)
+        ScheduleValidationLog.query.filter_by(team_id=team_id).delete(synchronize_session=False)
+        RuleViolation.query.filter_by(team_id=team_id).delete(synchronize_session=False)
         db.session.commit()
+        invalidate_cached_validations(team_id)
         flash('Schedule and all related validation data deleted successfully.', 'success')
     else:
         flash('No schedule found for this team.', 'warning')
@@ -758,7 +1002,10 @@ def batch_generate():
     """Generate schedules for multiple teams in batches to control costs"""
     
     if request.method == 'GET':
-        teams = Team.query.all()
+        teams = Team.query.options(
+            selectinload(Team.members).selectinload(TeamMember.employee),
+            selectinload(Team.saved_schedule).load_only(SavedSchedule.generated_on)
+        ).all()
         return render_template('batch_generate.html', teams=teams)
     
     selected_team_ids = request.form.getlist('team_ids')
@@ -780,13 +1027,18 @@ def batch_generate():
     success_count = 0
     failed_teams = []
     
-    for team_id in selected_team_ids:
-        team = Team.query.get(int(team_id))
+    # Load every selected team with its roster, and the teams that already have schedules, up front
+    team_ids = [int(team_id) for team_id in selected_team_ids]
+    teams_by_id = {team.id: team for team in load_team_with_roster().filter(Team.id.in_(team_ids))}
+    existing_ids = set(db.session.scalars(select(SavedSchedule.team_id).where(SavedSchedule.team_id.in_(team_ids))))
+    
+    for team_id in team_ids:
+        team = teams_by_id.get(team_id)
         if not team:
             continue
             
         # Check if schedule already exists
-        if SavedSchedule.query.filter_by(team_id=team.id).first():
+        if team.id in existing_ids:
             failed_teams.append(f"{team.name} (schedule exists)")
             continue
         
@@ -798,13 +1050,15 @@ def batch_generate():
         
         # Generate schedule
         schedule_result = generate_monthly_assignments_enhanced(team, months, current_user.id)
+        invalidate_cost_limits(current_user.id)
         
         if schedule_result:
             new_schedule = SavedSchedule(
                 team_id=team.id,
-                schedule_data=json.dumps(schedule_result)
+                schedule_data=schedule_result
             )
             db.session.add(new_schedule)
+            existing_ids.add(team.id)  # A repeated id in the form then reports "schedule exists"
             success_count += 1
         else:
             failed_teams.append(f"{team.name} (generation failed)")
@@ -824,7 +1078,7 @@ def batch_generate():
 def emergency_schedule(team_id):
     """Generate emergency/fallback schedule when AI fails"""
     
-    team = Team.query.get_or_404(team_id)
+    team = load_team_with_roster().filter_by(id=team_id).first_or_404()
     
     # Simple round-robin fallback schedule
     active_employees = [m.employee for m in team.members if m.employee.is_active]
@@ -834,13 +1088,7 @@ def emergency_schedule(team_id):
         return redirect(url_for('main.generate_schedule', team_id=team_id))
     
     # Create minimal safe schedule
-    team_shifts_map = {
-        '3-shift': ['Morning', 'Afternoon', 'Night'], 
-        '4-shift': ['Morning', 'Afternoon', 'Evening', 'Night'],
-        '5-shift': ['Early Morning', 'Morning', 'Afternoon', 'Evening', 'Night']
-    }
-    
-    shifts = team_shifts_map.get(team.shift_template, ['Morning', 'Afternoon', 'Night'])
+    shifts = TEAM_SHIFTS_MAP.get(team.shift_template, TEAM_SHIFTS_MAP['3-shift'])
     people_per_shift = team.people_per_shift
     
     # Simple assignment - divide employees evenly
@@ -848,28 +1096,17 @@ def emergency_schedule(team_id):
     today = datetime.today()
     month_name = today.strftime('%B %Y')
     
+    # Names and titles are read once; the remaining employees (one per shift) become floaters
+    roster = [{'name': e.name, 'designation': e.designation.title} for e in active_employees]
+    remaining_start = len(shifts) * people_per_shift
+    
     monthly_assignment = {}
     for i, shift in enumerate(shifts):
-        shift_team = []
+        shift_team = [dict(roster[(i * people_per_shift + j) % len(roster)]) for j in range(people_per_shift)]
         floaters = []
-        
-        # Assign fixed staff
-        for j in range(people_per_shift):
-            emp_index = (i * people_per_shift + j) % len(active_employees)
-            shift_team.append({
-                'name': active_employees[emp_index].name,
-                'designation': active_employees[emp_index].designation.title
-            })
-        
-        # Remaining employees as floaters
-        remaining_start = len(shifts) * people_per_shift
-        if remaining_start < len(active_employees):
-            floater_index = remaining_start + i
-            if floater_index < len(active_employees):
-                floaters.append({
-                    'name': active_employees[floater_index].name,
-                    'designation': active_employees[floater_index].designation.title
-                })
+        floater_index = remaining_start + i
+        if floater_index < len(roster):
+            floaters.append(dict(roster[floater_index]))
         
         monthly_assignment[shift] = {
             'assigned_staff': shift_team,
@@ -881,11 +1118,11 @@ def emergency_schedule(team_id):
     # Save emergency schedule
     existing_schedule = SavedSchedule.query.filter_by(team_id=team_id).first()
     if existing_schedule:
-        existing_schedule.schedule_data = json.dumps(emergency_schedule)
+        existing_schedule.schedule_data = emergency_schedule
     else:
         new_schedule = SavedSchedule(
             team_id=team_id,
-            schedule_data=json.dumps(emergency_schedule)
+            schedule_data=emergency_schedule
         )
         db.session.add(new_schedule)
     
@@ -920,8 +1157,14 @@ def update_employee():
     if not emp:
         flash('Employee not found.', 'danger')
         return redirect(url_for('main.manage_employees'))
+    parsed_dates = []
+    for d in leave_dates.split(','):
+        try:
+            parsed_dates.append(datetime.strptime(d.strip(), "%Y-%m-%d").date())
+        except ValueError:
+            continue
     emp.designation_id = designation_id
-    emp.leave_dates = leave_dates
+    sync_leave_dates(emp, parsed_dates)
     db.session.commit()
     flash(f'Changes for {emp.name} saved successfully.', 'success')
     return redirect(url_for('main.manage_employees'))
@@ -929,20 +1172,11 @@ def update_employee():
 @main_bp.route('/team/delete/<int:team_id>', methods=['POST'])
 @login_required
 def delete_team(team_id):
-    team = Team.query.get_or_404(team_id)
-    
-    # Clean up all related data
-    SavedSchedule.query.filter_by(team_id=team_id).delete()
-    EmployeeHistory.query.filter_by(team_id=team_id).delete()
-    ScheduleValidationLog.query.filter_by(team_id=team_id).delete()
-    RuleViolation.query.filter_by(team_id=team_id).delete()
-    APIUsageLog.query.filter_by(team_id=team_id).delete()
-    
-    # Delete team members and team
-    for tm in team.members:
-        db.session.delete(tm)
-    db.session.delete(team)
+    # Members, schedules, history, logs and violations go with the team via ON DELETE CASCADE
+    if not db.session.execute(Team.__table__.delete().where(Team.id == team_id)).rowcount:
+        abort(404)
     db.session.commit()
+    invalidate_cached_validations(team_id)
     
     flash('Team and all associated data deleted successfully.', 'info')
     return redirect(url_for('main.manage_teams'))
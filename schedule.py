@@ -1,16 +1,88 @@
+import atexit
 import random
-import json
 import os
+import re
+import functools
 import hashlib
+import threading
+import time
 from datetime import datetime, timedelta
-from collections import defaultdict
-from flask import flash
+from collections import OrderedDict, defaultdict
+from flask import current_app, flash
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.exc import SQLAlchemyError
 import google.generativeai as genai
-from app import db
+import numpy as np
+import orjson
+import redis
+from scipy.optimize import linear_sum_assignment
+from app import db, redis_client
 
 # Import the new models for state management
 from models import EmployeeHistory, ScheduleValidationLog, APIUsageLog, ScheduleCache, RuleViolation
 
+# In-process LRU of committed ScheduleCache entries (cache_key -> (orjson bytes, expires_at));
+# entries are stored encoded so every hit decodes a private copy
+LOCAL_CACHE_SIZE = 128
+_local_schedule_cache = OrderedDict()
+_local_cache_lock = threading.Lock()
+
+# Cache hit counts are buffered in-process and written back by a per-worker flusher thread
+HIT_COUNT_FLUSH_INTERVAL = 60  # seconds
+_hit_buffer = defaultdict(int)
+_hit_buffer_lock = threading.Lock()
+_hit_flusher_pid = None  # Process the flusher was started in (gunicorn forks workers)
+
+# Increment a running cost counter only if it is already populated; missing counters
+# are rehydrated from APIUsageLog by the reader, so a bare INCRBYFLOAT would undercount
+_incr_cost_if_exists = redis_client.register_script(
+    "if redis.call('EXISTS', KEYS[1]) == 1 then return redis.call('INCRBYFLOAT', KEYS[1], ARGV[1]) end return false"
+)
+
+# Shift configuration
+SHIFT_DESIRABILITY_ORDER = ('Morning', 'Afternoon', 'Evening', 'Night', 'Early Morning')
+
+TEAM_SHIFTS_MAP = {
+    '3-shift': ('Morning', 'Afternoon', 'Night'),
+    '4-shift': ('Morning', 'Afternoon', 'Evening', 'Night'),
+    '5-shift': ('Early Morning', 'Morning', 'Afternoon', 'Evening', 'Night')
+}
+
+# Each template's shifts, most desirable first
+DESIRABLE_SHIFTS_BY_TEMPLATE = {
+    template: tuple(shift for shift in SHIFT_DESIRABILITY_ORDER if shift in shifts)
+    for template, shifts in TEAM_SHIFTS_MAP.items()
+}
+
+# "RULE <n> VIOLATION: <detail>"; the rule label is everything before the first colon
+_RULE_VIOLATION_RE = re.compile(r'(?P<rule>[^:]*?RULE\s*(?P<number>\d+)?[^:]*):(?P<detail>.*)', re.DOTALL)
+# Fallback for violations that mention RULE only after the first colon
+_LABEL_DETAIL_RE = re.compile(r'(?P<rule>[^:]*):(?P<detail>.*)', re.DOTALL)
+
+VALIDATION_CACHE_TTL = 86400  # seconds
+
+def _validation_cache_key(team_id, schedule_hash):
+    return f"val:{team_id}:{schedule_hash.hex()}"
+
+def invalidate_cached_validations(team_id):
+    """Drop the Redis-cached validation results for a team's schedules"""
+    index_key = f"val:keys:{team_id}"
+    try:
+        keys = redis_client.smembers(index_key)
+        redis_client.delete(index_key, *keys)
+    except redis.RedisError:
+        pass  # Entries expire on their own after VALIDATION_CACHE_TTL
+
+def cost_counter_keys(user_id, now=None):
+    """Redis keys (with TTLs) holding a user's running cost for the current UTC day and month"""
+    now = now or datetime.utcnow()
+    day_end = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    month_end = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+    return [
+        (f"cost:day:{user_id}:{now:%Y-%m-%d}", int((day_end - now).total_seconds()) + 3600),
+        (f"cost:month:{user_id}:{now:%Y-%m}", int((month_end - now).total_seconds()) + 3600),
+    ]
+
 # Enhanced scheduling rules with explicit constraints
 SCHEDULING_RULES_TEXT = """
 STRICT SCHEDULING RULES (ALL MUST BE ENFORCED):
@@ -47,6 +119,43 @@ VALIDATION REQUIREMENTS:
 - Provide specific employee names and months in violation reports
 """
 
+def _recent_history(team_id, employee_ids, limit):
+    """Map employee_id -> newest `limit` months of EmployeeHistory rows for the team, newest first.
+
+    Rows are ranked in SQL and returned as plain (employee_id, shift_assigned,
+    was_floater) rows, which avoids the ORM's eager loads.
+    """
+    ranked = select(
+        EmployeeHistory.employee_id,
+        EmployeeHistory.shift_assigned,
+        EmployeeHistory.was_floater,
+        func.row_number().over(
+            partition_by=EmployeeHistory.employee_id,
+            # Newest month first; rows saved together share created_at, which only breaks ties
+            order_by=(EmployeeHistory.month_year.desc(), EmployeeHistory.created_at.desc(), EmployeeHistory.id.desc())
+        ).label('rn')
+    ).where(
+        EmployeeHistory.team_id == team_id,
+        EmployeeHistory.employee_id.in_(employee_ids)
+    ).subquery()
+    rows = db.session.execute(
+        select(ranked).where(ranked.c.rn <= limit).order_by(ranked.c.employee_id, ranked.c.rn)
+    )
+    
+    history_by_employee = defaultdict(list)
+    for row in rows:
+        history_by_employee[row.employee_id].append(row)
+    return history_by_employee
+
+@functools.lru_cache(maxsize=256)
+def _parse_month_key(month_name):
+    """Convert 'January 2025' to the integer month key 202501 (None if it doesn't parse)"""
+    try:
+        date_obj = datetime.strptime(month_name, '%B %Y')
+        return date_obj.year * 100 + date_obj.month
+    except ValueError:
+        return None
+
 class EnhancedScheduleValidator:
     """Comprehensive validation engine for schedule rules"""
     
@@ -54,47 +163,67 @@ class EnhancedScheduleValidator:
         self.team_id = team_id
         self.violations = []
         
-    def validate_against_history(self, schedule_data):
-        """Validate schedule against historical assignments"""
+    def validate_against_history(self, schedule):
+        """Validate a decoded schedule dict against historical assignments"""
         violations = []
         
-        # Parse the schedule
-        schedule = json.loads(schedule_data) if isinstance(schedule_data, str) else schedule_data
+        # Resolve every named employee and their recent history up front
+        names = {
+            person['name']
+            for shifts in schedule.values()
+            for shift_data in shifts.values()
+            for person in shift_data.get('assigned_staff', []) + shift_data.get('floaters', [])
+        }
+        employees_by_name = self._load_employees(names)
+        history_by_employee = _recent_history(
+            self.team_id, [employee_id for employee_id, _ in employees_by_name.values()], 3
+        )
         
         for month_name, shifts in schedule.items():
-            month_key = self._parse_month_key(month_name)
+            # Violation messages label months as 'YYYY-MM'
+            month_number = _parse_month_key(month_name)
+            month_key = f"{month_number // 100}-{month_number % 100:02d}" if month_number else month_name
             
             # Check each shift assignment
             for shift_name, shift_data in shifts.items():
                 # Validate fixed staff
                 for staff in shift_data.get('assigned_staff', []):
                     employee_name = staff['name']
-                    violations.extend(self._check_employee_rules(employee_name, shift_name, month_key, False))
+                    violations.extend(self._check_employee_rules(
+                        employee_name, shift_name, month_key, False, employees_by_name, history_by_employee))
                 
                 # Validate floaters
                 for floater in shift_data.get('floaters', []):
                     employee_name = floater['name']
-                    violations.extend(self._check_employee_rules(employee_name, shift_name, month_key, True))
+                    violations.extend(self._check_employee_rules(
+                        employee_name, shift_name, month_key, True, employees_by_name, history_by_employee))
         
         return violations
     
-    def _check_employee_rules(self, employee_name, shift_name, month_key, is_floater):
+    def _load_employees(self, names):
+        """Map employee name -> (employee_id, hierarchy_level), first match by id as before"""
+        from models import Designation, Employee
+        employees_by_name = {}
+        for name, employee_id, hierarchy_level in db.session.query(
+            Employee.name, Employee.id, Designation.hierarchy_level
+        ).outerjoin(Designation, Employee.designation_id == Designation.id).filter(
+            Employee.name.in_(names)
+        ).order_by(Employee.id):
+            employees_by_name.setdefault(name, (employee_id, hierarchy_level))
+        return employees_by_name
+    
+    def _check_employee_rules(self, employee_name, shift_name, month_key, is_floater, employees_by_name, history_by_employee):
         """Check all rules for a specific employee assignment"""
         violations = []
         
-        # Get employee history
-        from models import Employee
-        employee = Employee.query.filter_by(name=employee_name).first()
-        if not employee:
+        # Get employee and history from the preloaded maps
+        if employee_name not in employees_by_name:
             return [f"Employee {employee_name} not found in database"]
-        
-        history = EmployeeHistory.query.filter_by(
-            employee_id=employee.id, 
-            team_id=self.team_id
-        ).order_by(EmployeeHistory.created_at.desc()).limit(3).all()
+        employee_id, hierarchy_level = employees_by_name[employee_name]
+        history = history_by_employee[employee_id]
         
         # Rule 2: Check floater exemption
-        if is_floater and employee.designation.hierarchy_level == 1:
+        if is_floater and hierarchy_level == 1:
             violations.append(f"RULE 2 VIOLATION: {employee_name} (top hierarchy) cannot be assigned as floater in {month_key}")
         
         # Rule 3: Check consecutive floater assignment
@@ -105,7 +234,7 @@ class EnhancedScheduleValidator:
         
         # Rule 4: Check shift rotation for non-stable employees
         if not is_floater and history:
-            stability_months = self._get_stability_months(employee.designation.hierarchy_level)
+            stability_months = self._get_stability_months(hierarchy_level)
             if stability_months <= 1:  # Must rotate monthly
                 last_assignment = history[0]
                 if last_assignment.shift_assigned == shift_name:
@@ -122,178 +251,257 @@ class EnhancedScheduleValidator:
         else:
             return 1
     
-    def _parse_month_key(self, month_name):
-        """Convert 'January 2025' to '2025-01' format"""
-        try:
-            date_obj = datetime.strptime(month_name, '%B %Y')
-            return date_obj.strftime('%Y-%m')
-        except:
-            return month_name
-
 class StateManager:
     """Manages historical state and provides context for scheduling decisions"""
     
     def __init__(self, team_id):
         self.team_id = team_id
     
-    def get_employee_context(self, employee_id, months_back=3):
-        """Get historical context for an employee"""
-        history = EmployeeHistory.query.filter_by(
-            employee_id=employee_id,
-            team_id=self.team_id
-        ).order_by(EmployeeHistory.created_at.desc()).limit(months_back).all()
-        
-        return {
-            'last_shifts': [h.shift_assigned for h in history if h.shift_assigned],
-            'floater_history': [h.was_floater for h in history],
-            'months_since_floater': self._calculate_months_since_floater(history),
-            'consecutive_shift_count': self._calculate_consecutive_shifts(history)
-        }
-    
-    def _calculate_months_since_floater(self, history):
-        """Calculate how many months since employee was a floater"""
-        for i, record in enumerate(history):
-            if record.was_floater:
-                return i
-        return len(history)  # Never been floater
+    def get_contexts(self, employee_ids, months_back=3):
+        """Historical context for many employees at once: {employee_id: context}"""
+        history_by_employee = _recent_history(self.team_id, employee_ids, months_back)
+        return {emp_id: self._context_from_history(history_by_employee[emp_id]) for emp_id in employee_ids}
     
-    def _calculate_consecutive_shifts(self, history):
-        """Calculate consecutive months on same shift"""
-        if not history:
-            return 0
+    def _context_from_history(self, history):
+        """Build the scheduling context from history rows ordered newest first, in one pass"""
+        last_shifts = []
+        floater_history = []
+        months_since_floater = None
+        consecutive_shift_count = 0
+        consecutive_open = True
         
-        current_shift = history[0].shift_assigned
-        count = 1
-        
-        for record in history[1:]:
-            if record.shift_assigned == current_shift:
-                count += 1
+        for i, record in enumerate(history):
+            if record.shift_assigned:
+                last_shifts.append(record.shift_assigned)
+            floater_history.append(record.was_floater)
+            if record.was_floater and months_since_floater is None:
+                months_since_floater = i
+            # Consecutive months on the same shift as the latest record
+            if consecutive_open and record.shift_assigned == history[0].shift_assigned:
+                consecutive_shift_count += 1
             else:
-                break
+                consecutive_open = False
         
-        return count
+        return {
+            'last_shifts': last_shifts,
+            'floater_history': floater_history,
+            'months_since_floater': len(history) if months_since_floater is None else months_since_floater,  # Never been floater
+            'consecutive_shift_count': consecutive_shift_count
+        }
     
-    def save_assignment_history(self, schedule_data):
-        """Save current schedule to history for future reference"""
-        schedule = json.loads(schedule_data) if isinstance(schedule_data, str) else schedule_data
+    def save_assignment_history(self, schedule):
+        """Save a decoded schedule dict to history for future reference (committed by the caller)"""
+        from models import Employee
         
+        # (employee_name, month_key) -> (shift_assigned, was_floater, floater_for_shift); a repeated
+        # assignment keeps the latest one
+        assignments = {}
         for month_name, shifts in schedule.items():
-            month_key = self._parse_month_key(month_name)
+            month_key = _parse_month_key(month_name)
+            if month_key is None:
+                continue
             
             for shift_name, shift_data in shifts.items():
-                # Save fixed staff assignments
+                # Fixed staff assignments
                 for staff in shift_data.get('assigned_staff', []):
-                    self._save_employee_history(staff['name'], month_key, shift_name, False, None)
+                    assignments[(staff['name'], month_key)] = (shift_name, False, None)
                 
-                # Save floater assignments
+                # Floater assignments
                 for floater in shift_data.get('floaters', []):
-                    self._save_employee_history(floater['name'], month_key, None, True, shift_name)
-    
-    def _save_employee_history(self, employee_name, month_key, shift_assigned, was_floater, floater_for_shift):
-        """Save individual employee history record"""
-        from models import Employee
-        employee = Employee.query.filter_by(name=employee_name).first()
-        if not employee:
+                    assignments[(floater['name'], month_key)] = (None, True, shift_name)
+        
+        if not assignments:
             return
         
-        # Check if record already exists
-        existing = EmployeeHistory.query.filter_by(
-            employee_id=employee.id,
-            team_id=self.team_id,
-            month_year=month_key
-        ).first()
-        
-        if existing:
-            # Update existing record
-            existing.shift_assigned = shift_assigned
-            existing.was_floater = was_floater
-            existing.floater_for_shift = floater_for_shift
-        else:
-            # Create new record
-            history = EmployeeHistory(
-                employee_id=employee.id,
-                team_id=self.team_id,
-                month_year=month_key,
-                shift_assigned=shift_assigned,
-                was_floater=was_floater,
-                floater_for_shift=floater_for_shift
+        # Resolve employee names (first match by id, as before) and existing rows in one query each
+        names = {name for name, _ in assignments}
+        name_to_id = {}
+        for name, employee_id in db.session.query(Employee.name, Employee.id).filter(
+                Employee.name.in_(names)).order_by(Employee.id):
+            name_to_id.setdefault(name, employee_id)
+        
+        months = {month_key for _, month_key in assignments}
+        existing = {
+            (employee_id, month_year): history_id
+            for history_id, employee_id, month_year in db.session.query(
+                EmployeeHistory.id, EmployeeHistory.employee_id, EmployeeHistory.month_year
+            ).filter(
+                EmployeeHistory.team_id == self.team_id,
+                EmployeeHistory.month_year.in_(months),
+                EmployeeHistory.employee_id.in_(name_to_id.values())
             )
-            db.session.add(history)
+        }
         
-        db.session.commit()
-    
-    def _parse_month_key(self, month_name):
-        """Convert 'January 2025' to '2025-01' format"""
-        try:
-            date_obj = datetime.strptime(month_name, '%B %Y')
-            return date_obj.strftime('%Y-%m')
-        except:
-            return month_name
+        inserts = {}
+        updates = {}
+        for (name, month_key), (shift_assigned, was_floater, floater_for_shift) in assignments.items():
+            employee_id = name_to_id.get(name)
+            if employee_id is None:
+                continue
+            values = {
+                'shift_assigned': shift_assigned,
+                'was_floater': was_floater,
+                'floater_for_shift': floater_for_shift
+            }
+            history_id = existing.get((employee_id, month_key))
+            if history_id is not None:
+                updates[history_id] = {'id': history_id, **values}
+            else:
+                inserts[(employee_id, month_key)] = {
+                    'employee_id': employee_id,
+                    'team_id': self.team_id,
+                    'month_year': month_key,
+                    **values
+                }
+        
+        if inserts:
+            db.session.bulk_insert_mappings(EmployeeHistory, list(inserts.values()))
+        if updates:
+            db.session.bulk_update_mappings(EmployeeHistory, list(updates.values()))
 
 class CacheManager:
     """Manages caching for schedules and prompts to reduce API costs"""
     
     @staticmethod
-    def generate_cache_key(team_id, months, team_config):
-        """Generate unique cache key for team configuration"""
-        config_str = f"{team_id}_{months}_{json.dumps(team_config, sort_keys=True)}"
-        return hashlib.md5(config_str.encode()).hexdigest()
+    def generate_cache_key(team_id, months, member_count, shift_template, people_per_shift):
+        """Generate unique cache key for team configuration (32-byte BLAKE2b digest)"""
+        config_str = f"{team_id}|{months}|{member_count}|{shift_template}|{people_per_shift}"
+        return hashlib.blake2b(config_str.encode(), digest_size=32).digest()
     
     @staticmethod
     def get_cached_schedule(cache_key):
-        """Retrieve cached schedule if available"""
-        cache_entry = ScheduleCache.query.filter_by(
-            cache_key=cache_key,
-            cache_type='schedule'
-        ).first()
+        """Retrieve cached schedule if available and not expired"""
+        now = datetime.utcnow()
+        cached_data = CacheManager._get_local(cache_key, now)
+        
+        if cached_data is None:
+            row = db.session.query(ScheduleCache.cached_data, ScheduleCache.expires_at).filter(
+                ScheduleCache.cache_key == cache_key,
+                ScheduleCache.cache_type == 'schedule',
+                db.or_(ScheduleCache.expires_at.is_(None), ScheduleCache.expires_at > now)
+            ).first()
+            if row is None:
+                return None
+            cached_data = row.cached_data
+            CacheManager._put_local(cache_key, orjson.dumps(cached_data), row.expires_at)
+        
+        # Record the hit in memory; hit_count is written back in batches
+        with _hit_buffer_lock:
+            _hit_buffer[cache_key] += 1
+        CacheManager._start_hit_flusher(current_app._get_current_object())
+        return cached_data
+    
+    @staticmethod
+    def _get_local(cache_key, now):
+        """Decode a fresh copy from the in-process LRU, dropping the entry if it has expired"""
+        with _local_cache_lock:
+            entry = _local_schedule_cache.get(cache_key)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del _local_schedule_cache[cache_key]
+                return None
+            _local_schedule_cache.move_to_end(cache_key)
+        return orjson.loads(data)
+    
+    @staticmethod
+    def _put_local(cache_key, data, expires_at):
+        with _local_cache_lock:
+            _local_schedule_cache[cache_key] = (data, expires_at)
+            _local_schedule_cache.move_to_end(cache_key)
+            while len(_local_schedule_cache) > LOCAL_CACHE_SIZE:
+                _local_schedule_cache.popitem(last=False)
+    
+    @staticmethod
+    def _start_hit_flusher(app):
+        """Start this worker's hit-count flusher (every HIT_COUNT_FLUSH_INTERVAL and at exit) once"""
+        global _hit_flusher_pid
+        
+        with _hit_buffer_lock:
+            if _hit_flusher_pid == os.getpid():
+                return
+            _hit_flusher_pid = os.getpid()
+        
+        def flush():
+            with app.app_context():
+                CacheManager.flush_hit_counts()
+        
+        def run():
+            while True:
+                time.sleep(HIT_COUNT_FLUSH_INTERVAL)
+                try:
+                    flush()
+                except Exception:
+                    app.logger.exception("Flushing cache hit counts failed")
+        
+        # Under gunicorn's gevent workers this thread is a greenlet
+        threading.Thread(target=run, daemon=True).start()
+        atexit.register(flush)
+    
+    @staticmethod
+    def flush_hit_counts():
+        """Write buffered cache hit counts back to the database"""
+        with _hit_buffer_lock:
+            pending = dict(_hit_buffer)
+            _hit_buffer.clear()
         
-        if cache_entry and cache_entry.expires_at > datetime.utcnow():
-            cache_entry.hit_count += 1
-            db.session.commit()
-            return json.loads(cache_entry.cached_data)
+        if not pending:
+            return
         
-        return None
+        # Own connection and transaction, so a flush never commits the request's session
+        update = ScheduleCache.__table__.update().where(
+            ScheduleCache.cache_key == bindparam('key')
+        ).values(hit_count=ScheduleCache.hit_count + bindparam('hits'))
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(update, [{'key': cache_key, 'hits': hits} for cache_key, hits in pending.items()])
+        except SQLAlchemyError:
+            # Keep the counts for the next flush
+            with _hit_buffer_lock:
+                for cache_key, hits in pending.items():
+                    _hit_buffer[cache_key] += hits
+            raise
     
     @staticmethod
     def save_to_cache(cache_key, data, cache_type='schedule', expire_hours=24):
-        """Save data to cache"""
+        """Save data to cache (committed by the caller)"""
         expire_time = datetime.utcnow() + timedelta(hours=expire_hours)
         
         cache_entry = ScheduleCache(
             cache_key=cache_key,
-            cached_data=json.dumps(data),
+            cached_data=data,
             cache_type=cache_type,
             expires_at=expire_time
         )
         
         db.session.add(cache_entry)
-        db.session.commit()
 
 def generate_monthly_assignments_enhanced(team, months, user_id=None):
-    """Enhanced schedule generation with state management"""
+    """Enhanced schedule generation with state management.
+
+    History, cache and usage rows are only added to the session; the calling
+    view commits them together with the saved schedule.
+    """
     
     # Initialize state management
     state_manager = StateManager(team.id)
     
-    # Check for cached result first
-    team_config = {
-        'member_count': len([m for m in team.members if m.employee.is_active]),
-        'shift_template': team.shift_template,
-        'people_per_shift': team.people_per_shift
-    }
+    # Active employees only, collected in a single pass over the roster
+    active = [m.employee for m in team.members if m.employee.is_active]
     
-    cache_key = CacheManager.generate_cache_key(team.id, months, team_config)
+    # Check for cached result first
+    member_count = len(active)
+    cache_key = CacheManager.generate_cache_key(
+        team.id, months, member_count, team.shift_template, team.people_per_shift
+    )
     cached_schedule = CacheManager.get_cached_schedule(cache_key)
     
     if cached_schedule:
         flash("Using cached schedule to save costs.", "info")
         return cached_schedule
     
-    # Get active employees only
-    all_employees = sorted(
-        [m.employee for m in team.members if m.employee.is_active],
-        key=lambda e: e.designation.hierarchy_level
-    )
+    all_employees = sorted(active, key=lambda e: e.designation.hierarchy_level)
     
     if not all_employees:
         flash("No active employees in this team.", "danger")
@@ -311,24 +519,14 @@ def generate_monthly_assignments_enhanced(team, months, user_id=None):
         
         # Log API usage if applicable
         if user_id:
-            _log_api_usage(user_id, team.id, 'generate', len(str(schedule_result)))
+            _log_api_usage(user_id, team.id, 'generate', len(orjson.dumps(schedule_result)))
     
     return schedule_result
 
 def _generate_with_constraints(team, all_employees, months, state_manager):
     """Generate schedule with strict constraint checking"""
     
-    # Configuration
-    SHIFT_DESIRABILITY_ORDER = ['Morning', 'Afternoon', 'Evening', 'Night', 'Early Morning']
-    
-    team_shifts_map = {
-        '3-shift': ['Morning', 'Afternoon', 'Night'], 
-        '4-shift': ['Morning', 'Afternoon', 'Evening', 'Night'],
-        '5-shift': ['Early Morning', 'Morning', 'Afternoon', 'Evening', 'Night']
-    }
-    
-    shifts_in_template = team_shifts_map.get(team.shift_template, [])
-    desirable_shifts = [s for s in SHIFT_DESIRABILITY_ORDER if s in shifts_in_template]
+    desirable_shifts = DESIRABLE_SHIFTS_BY_TEMPLATE.get(team.shift_template, ())
     num_shifts = len(desirable_shifts)
     
     if num_shifts == 0:
@@ -339,9 +537,7 @@ def _generate_with_constraints(team, all_employees, months, state_manager):
     required_for_fixed = num_shifts * people_per_shift
     
     # Get historical context for all employees
-    employee_contexts = {}
-    for emp in all_employees:
-        employee_contexts[emp.id] = state_manager.get_employee_context(emp.id)
+    employee_contexts = state_manager.get_contexts([emp.id for emp in all_employees])
     
     all_months_assignments = {}
     today = datetime.today()
@@ -384,30 +580,34 @@ def _generate_month_with_constraints(employees, contexts, shifts, people_per_shi
         floater_candidates = floater_candidates[:num_floaters]
     
     # Fixed staff pool
-    fixed_staff = [e for e in employees if e not in floater_candidates]
+    floater_ids = {e.id for e in floater_candidates}
+    fixed_staff = [e for e in employees if e.id not in floater_ids]
     
     # Assign shifts with rotation constraints
     monthly_assignments = {}
-    available_shifts = list(shifts)
+    # Shift each monthly-rotating employee must leave (their last one); stable staff are absent
+    must_leave_shift = {
+        emp.id: contexts[emp.id]['last_shifts'][0]
+        for emp in fixed_staff
+        if contexts[emp.id]['last_shifts'] and _get_stability_months(emp.designation.hierarchy_level) <= 1
+    }
+    
+    # Assign fixed staff to round-robin shift slots in one optimal assignment: a rotation
+    # violation costs more than any number of moves, and each move away from the employee's
+    # round-robin shift costs 1, so staff only move when the rotation rules require it
+    num_staff = len(fixed_staff)
+    slot_shift = np.arange(num_staff) % len(shifts)
+    shift_index = {shift_name: i for i, shift_name in enumerate(shifts)}
+    left_shift = np.array([shift_index.get(must_leave_shift.get(emp.id), -1) for emp in fixed_staff], dtype=int)
+    cost = (slot_shift[:, None] != slot_shift[None, :]).astype(float)
+    cost[left_shift[:, None] == slot_shift[None, :]] += num_staff + 1
+    staff_rows, slots = linear_sum_assignment(cost)
     
-    # Group fixed staff and assign shifts
     shift_teams = [[] for _ in range(len(shifts))]
-    for i, emp in enumerate(fixed_staff):
-        shift_teams[i % len(shifts)].append(emp)
-    
-    # Apply rotation rules
-    for i, (shift_name, team) in enumerate(zip(shifts, shift_teams)):
-        # Check if any team member violates rotation rules
-        for emp in team:
-            context = contexts[emp.id]
-            stability_months = _get_stability_months(emp.designation.hierarchy_level)
-            
-            if stability_months <= 1 and context['last_shifts']:  # Must rotate
-                if context['last_shifts'][0] == shift_name:
-                    # Try to swap with another team
-                    if i + 1 < len(shift_teams):
-                        shift_teams[i], shift_teams[i + 1] = shift_teams[i + 1], shift_teams[i]
-        
+    for slot, row in sorted(zip(slots, staff_rows)):
+        shift_teams[slot_shift[slot]].append(fixed_staff[row])
+    
+    for shift_name, team in zip(shifts, shift_teams):
         monthly_assignments[shift_name] = {
             'assigned_staff': [{'name': emp.name, 'designation': emp.designation.title} for emp in team],
             'floaters': []
@@ -432,12 +632,34 @@ def _get_stability_months(hierarchy_level):
     else:
         return 1
 
-def validate_schedule_with_enhanced_ai(schedule_data, team_id, api_key):
-    """Enhanced validation with historical context"""
+@functools.lru_cache(maxsize=1)  # genai.configure is process-global, so only one key can be live
+def _get_validation_model(api_key):
+    """Configure the Gemini client once per API key and reuse its model (and connections) across calls"""
+    # REST goes through the (gevent-patched) socket module; the default gRPC transport would
+    # block a gevent worker's whole event loop for the duration of the call
+    genai.configure(api_key=api_key, transport='rest')
+    model = genai.GenerativeModel('gemini-1.5-flash')
+    generation_config = genai.types.GenerationConfig(
+        response_mime_type="application/json"
+    )
+    return model, generation_config
+
+def validate_schedule_with_enhanced_ai(schedule, team_id, api_key):
+    """Enhanced validation of a decoded schedule dict with historical context.
+
+    Log rows are committed by the caller.
+    """
+    
+    # Validation only depends on the schedule, so reuse an earlier result for identical content
+    schedule_hash = _schedule_hash(schedule)
+    cached_result = _get_cached_validation(team_id, schedule_hash)
+    if cached_result is not None:
+        return cached_result
     
     # First, validate against historical rules
     validator = EnhancedScheduleValidator(team_id)
-    rule_violations = validator.validate_against_history(schedule_data)
+    rule_violations = validator.validate_against_history(schedule)
+    schedule_json = orjson.dumps(schedule, option=orjson.OPT_NON_STR_KEYS).decode()
     
     # Then validate with AI
     enhanced_prompt = f"""
@@ -447,10 +669,10 @@ def validate_schedule_with_enhanced_ai(schedule_data, team_id, api_key):
     {SCHEDULING_RULES_TEXT}
     
     SCHEDULE TO VALIDATE:
-    {schedule_data}
+    {schedule_json}
     
     HISTORICAL VIOLATIONS FOUND:
-    {json.dumps(rule_violations)}
+    {orjson.dumps(rule_violations).decode()}
     
     Return a JSON object with:
     {{
@@ -463,16 +685,13 @@ def validate_schedule_with_enhanced_ai(schedule_data, team_id, api_key):
     """
     
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        generation_config = genai.types.GenerationConfig(
-            response_mime_type="application/json"
-        )
+        model, generation_config = _get_validation_model(api_key)
         response = model.generate_content(enhanced_prompt, generation_config=generation_config)
-        result = json.loads(response.text)
+        result = orjson.loads(response.text)
         
         # Log validation results
-        _log_validation_result(team_id, result)
+        _log_validation_result(team_id, result, schedule_hash)
+        _cache_validation(team_id, schedule_hash, result)
         
         # Save specific violations to database
         _save_rule_violations(team_id, result.get('violations', []))
@@ -490,6 +709,55 @@ def validate_schedule_with_enhanced_ai(schedule_data, team_id, api_key):
         _log_validation_result(team_id, error_result)
         return error_result
 
+VALIDATION_PENDING_TTL = 300  # seconds; upper bound on one background validation
+# Teams with a background validation running in this process, used when Redis is unavailable
+_inflight_validations = set()
+_inflight_lock = threading.Lock()
+
+def validation_pending(team_id):
+    """Whether a background validation is currently running for the team"""
+    try:
+        return bool(redis_client.exists(f"val:pending:{team_id}"))
+    except redis.RedisError:
+        return team_id in _inflight_validations
+
+def validate_schedule_in_background(app, schedule, team_id, api_key):
+    """Run validate_schedule_with_enhanced_ai off the request path.
+
+    The result lands in ScheduleValidationLog (and the validation cache). Returns
+    False without starting anything if a validation is already running for the team
+    (tracked per process while Redis is unavailable).
+    """
+    pending_key = f"val:pending:{team_id}"
+    try:
+        if not redis_client.set(pending_key, 1, nx=True, ex=VALIDATION_PENDING_TTL):
+            return False
+    except redis.RedisError:
+        pending_key = None
+        with _inflight_lock:
+            if team_id in _inflight_validations:
+                return False
+            _inflight_validations.add(team_id)
+    
+    def run():
+        with app.app_context():
+            try:
+                validate_schedule_with_enhanced_ai(schedule, team_id, api_key)
+                db.session.commit()
+            finally:
+                if pending_key:
+                    try:
+                        redis_client.delete(pending_key)
+                    except redis.RedisError:
+                        pass
+                else:
+                    with _inflight_lock:
+                        _inflight_validations.discard(team_id)
+    
+    # Under gunicorn's gevent workers this thread is a greenlet
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
 def _log_api_usage(user_id, team_id, api_type, tokens_estimate):
     """Log API usage for cost tracking"""
     # Rough cost estimation (adjust based on actual API pricing)
@@ -505,46 +773,81 @@ def _log_api_usage(user_id, team_id, api_type, tokens_estimate):
     )
     
     db.session.add(usage_log)
-    db.session.commit()
+    
+    try:
+        for key, _ in cost_counter_keys(user_id):
+            _incr_cost_if_exists(keys=[key], args=[estimated_cost])
+    except redis.RedisError:
+        pass  # Counters are rebuilt from APIUsageLog on the next read
+
+def _schedule_hash(schedule):
+    return hashlib.sha256(orjson.dumps(schedule, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)).digest()
+
+def get_cached_validation(schedule, team_id):
+    """Earlier successful validation result for this exact schedule dict, or None"""
+    return _get_cached_validation(team_id, _schedule_hash(schedule))
+
+def _get_cached_validation(team_id, schedule_hash):
+    """Return an earlier validation result for an identical schedule, from Redis or the validation log"""
+    cache_key = _validation_cache_key(team_id, schedule_hash)
+    try:
+        cached = redis_client.get(cache_key)
+        if cached is not None:
+            return orjson.loads(cached)
+    except redis.RedisError:
+        pass
+    
+    result = db.session.query(ScheduleValidationLog.validation_result).filter(
+        ScheduleValidationLog.team_id == team_id,
+        ScheduleValidationLog.schedule_hash == schedule_hash
+    ).order_by(ScheduleValidationLog.validated_at.desc()).limit(1).scalar()
+    if result is not None:
+        _cache_validation(team_id, schedule_hash, result)
+    return result
+
+def _cache_validation(team_id, schedule_hash, validation_result):
+    """Keep a validation result in Redis for VALIDATION_CACHE_TTL, indexed by team for invalidation"""
+    cache_key = _validation_cache_key(team_id, schedule_hash)
+    index_key = f"val:keys:{team_id}"
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(cache_key, orjson.dumps(validation_result), ex=VALIDATION_CACHE_TTL)
+        pipe.sadd(index_key, cache_key)
+        pipe.expire(index_key, VALIDATION_CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError:
+        pass
 
-def _log_validation_result(team_id, validation_result):
-    """Log validation results"""
+def _log_validation_result(team_id, validation_result, schedule_hash=None):
+    """Log validation results (failed validations are logged without a hash so they are retried)"""
     log_entry = ScheduleValidationLog(
         team_id=team_id,
-        validation_result=json.dumps(validation_result),
+        validation_result=validation_result,
         violations_found=validation_result.get('total_violations', 0),
-        is_valid=validation_result.get('is_valid', False)
+        is_valid=validation_result.get('is_valid', False),
+        schedule_hash=schedule_hash
     )
     
     db.session.add(log_entry)
-    db.session.commit()
 
 def _save_rule_violations(team_id, violations):
     """Save individual rule violations for tracking"""
+    month_year = int(datetime.now().strftime('%Y%m'))
+    violation_records = []
     for violation in violations:
-        if isinstance(violation, str) and 'RULE' in violation:
-            # Parse rule number and details
-            parts = violation.split(':', 1)
-            if len(parts) == 2:
-                rule_part = parts[0]
-                detail_part = parts[1].strip()
-                
-                # Extract rule number
-                rule_number = None
-                if 'RULE' in rule_part:
-                    try:
-                        rule_number = int(rule_part.split('RULE')[1].split()[0])
-                    except:
-                        rule_number = 0
-                
-                violation_record = RuleViolation(
-                    team_id=team_id,
-                    rule_number=rule_number or 0,
-                    rule_description=rule_part,
-                    violation_detail=detail_part,
-                    month_year=datetime.now().strftime('%Y-%m')
-                )
-                
-                db.session.add(violation_record)
-    
-    db.session.commit()
+        if not isinstance(violation, str) or 'RULE' not in violation:
+            continue
+        match = _RULE_VIOLATION_RE.match(violation) or _LABEL_DETAIL_RE.match(violation)
+        if match is None:
+            continue  # No colon, so no detail to record
+        
+        violation_records.append(RuleViolation(
+            team_id=team_id,
+            rule_number=int(match.groupdict().get('number') or 0),
+            rule_description=match['rule'],
+            violation_detail=match['detail'].strip(),
+            month_year=month_year
+        ))
+    
+    if violation_records:
+        db.session.bulk_save_objects(violation_records)